@@ -3,7 +3,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
+import asyncio
+import os
 from datetime import datetime
+from src.services.notification import NotificationQueue, SMTPConnectionPool, AlertDispatcher
+from src.services.price_service import PriceService
 
 app = FastAPI(
     title="跨境电商价格比较工具",
@@ -20,6 +24,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 价格服务记录观测到的价格并触发价格提醒，提醒由后台任务异步批量发送
+@app.on_event("startup")
+async def start_services():
+    app.state.notification_queue = NotificationQueue()
+    app.state.price_service = PriceService(
+        {
+            'fair_api_key': os.getenv("FAIR_API_KEY"),
+            'price_api_key': os.getenv("PRICE_API_KEY"),
+            'taobao': {
+                'app_key': os.getenv("TAOBAO_APPKEY"),
+                'app_secret': os.getenv("TAOBAO_SECRET")
+            }
+        },
+        app.state.notification_queue
+    )
+    app.state.alert_dispatcher = None
+    sender = os.getenv("SMTP_FROM") or os.getenv("SMTP_USERNAME")
+    if not sender:
+        print("未配置SMTP_FROM，价格提醒通知不会发送")
+        return
+    app.state.alert_dispatcher = AlertDispatcher(
+        app.state.notification_queue,
+        SMTPConnectionPool(
+            os.getenv("SMTP_SERVER", "localhost"),
+            int(os.getenv("SMTP_PORT", "587")),
+            os.getenv("SMTP_USERNAME"),
+            os.getenv("SMTP_PASSWORD"),
+            size=int(os.getenv("SMTP_POOL_SIZE", "4")),
+            use_tls=os.getenv("SMTP_USE_TLS", "true").lower() not in ("0", "false", "no")
+        ),
+        sender
+    )
+    app.state.dispatcher_task = asyncio.create_task(app.state.alert_dispatcher.run())
+
+@app.on_event("shutdown")
+async def stop_services():
+    if app.state.alert_dispatcher:
+        app.state.alert_dispatcher.stop()
+        await app.state.dispatcher_task
+    app.state.price_service.price_stats.close()
+    app.state.notification_queue.close()
+
 # 数据模型
 class ProductSearch(BaseModel):
     keyword: str
@@ -27,6 +73,7 @@ class ProductSearch(BaseModel):
     
 class PriceAlert(BaseModel):
     product_id: int
+    platform: str = "taobao"
     target_price: float
     email: str
 
@@ -38,24 +85,28 @@ async def root():
 async def search_products(search: ProductSearch):
     """搜索商品并比较价格"""
     try:
-        # TODO: 实现商品搜索和价格比较逻辑
+        results = await app.state.price_service.search_product_all_platforms(search.keyword)
         return {
             "status": "success",
             "message": "搜索成功",
-            "data": []
+            "data": results
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/product/{product_id}")
-async def get_product_details(product_id: int):
+async def get_product_details(product_id: int, platform: str = "taobao"):
     """获取商品详细信息和价格历史"""
     try:
-        # TODO: 实现获取商品详情和价格历史的逻辑
+        price_service = app.state.price_service
+        details = await price_service.get_product_details(str(product_id), platform)
+        analysis = await asyncio.get_running_loop().run_in_executor(
+            None, price_service.get_price_analysis, str(product_id), platform
+        )
         return {
             "status": "success",
             "message": "获取成功",
-            "data": {}
+            "data": {"details": details, "analysis": analysis}
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -64,11 +115,18 @@ async def get_product_details(product_id: int):
 async def create_price_alert(alert: PriceAlert):
     """创建价格提醒"""
     try:
-        # TODO: 实现创建价格提醒的逻辑
+        alert_id = await asyncio.get_running_loop().run_in_executor(
+            None,
+            app.state.notification_queue.add_alert,
+            alert.platform,
+            alert.product_id,
+            alert.target_price,
+            alert.email
+        )
         return {
             "status": "success",
             "message": "创建价格提醒成功",
-            "data": alert
+            "data": {"id": alert_id, **alert.dict()}
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,356 @@
+import asyncio
+import smtplib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.message import EmailMessage
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class NotificationQueue:
+    """
+    基于SQLite的持久化发件队列，进程重启后未发送的通知不会丢失
+    同时保存价格提醒订阅，价格达到目标时批量生成通知
+    """
+
+    def __init__(self, db_path: str = 'cache/notifications.db'):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 数据库操作在线程池中执行以免阻塞事件循环，连接跨线程共享，由锁串行化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_attempt_at)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_outbox_email ON outbox (email, status)'
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS price_alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                platform TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                target_price REAL NOT NULL,
+                email TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_price_alerts_product ON price_alerts (platform, product_id, target_price)'
+        )
+        # 上次进程退出时正在发送的消息重新入队
+        self._conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        self._conn.commit()
+
+    def enqueue(self, email: str, subject: str, body: str):
+        """添加一条待发送通知"""
+        self.enqueue_many([{'email': email, 'subject': subject, 'body': body}])
+
+    def enqueue_many(self, messages: List[Dict]):
+        """
+        批量添加待发送通知
+        messages: [{'email': 'a@b.com', 'subject': '...', 'body': '...'}, ...]
+        """
+        with self._lock, self._conn:
+            self._insert(messages)
+
+    def _insert(self, messages: List[Dict]):
+        now = time.time()
+        self._conn.executemany(
+            'INSERT INTO outbox (email, subject, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+            [(m['email'], m['subject'], m['body'], now, now) for m in messages]
+        )
+
+    @staticmethod
+    def _price_alert_message(email: str, product_id, target_price: float, current_price: float) -> Dict:
+        return {
+            'email': email,
+            'subject': f"价格提醒：商品 {product_id} 已降至 {current_price:.2f}",
+            'body': f"商品 {product_id} 当前价格 {current_price:.2f}，已达到您设置的目标价格 {target_price:.2f}。"
+        }
+
+    def enqueue_price_alert(self, email: str, product_id: int, target_price: float, current_price: float):
+        """添加价格提醒通知"""
+        self.enqueue_many([self._price_alert_message(email, product_id, target_price, current_price)])
+
+    def add_alert(self, platform: str, product_id, target_price: float, email: str) -> int:
+        """保存价格提醒订阅，返回订阅ID"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO price_alerts (platform, product_id, target_price, email, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (platform, str(product_id), target_price, email, time.time())
+            )
+        return cursor.lastrowid
+
+    def trigger_alerts(self, platform: str, product_id, current_price: float) -> int:
+        """
+        价格达到目标的订阅全部转为待发送通知并删除，返回触发数量
+        可能写入大量通知，异步代码中需通过run_in_executor调用
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                'SELECT id, email, target_price FROM price_alerts '
+                'WHERE platform = ? AND product_id = ? AND target_price >= ?',
+                (platform, str(product_id), current_price)
+            ).fetchall()
+            if rows:
+                self._insert([
+                    self._price_alert_message(email, product_id, target_price, current_price)
+                    for _, email, target_price in rows
+                ])
+                self._conn.executemany('DELETE FROM price_alerts WHERE id = ?', [(row[0],) for row in rows])
+        return len(rows)
+
+    def claim_batch(self, limit: int) -> List[Dict]:
+        """取出最多limit个收件人的全部到期通知并标记为发送中，便于按收件人合并"""
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, email, subject, body, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? AND email IN ("
+                "  SELECT email FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "  GROUP BY email ORDER BY MIN(id) LIMIT ?"
+                ") ORDER BY id",
+                (now, now, limit)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'sending' WHERE id = ?",
+                [(row[0],) for row in rows]
+            )
+        return [
+            {'id': r[0], 'email': r[1], 'subject': r[2], 'body': r[3], 'attempts': r[4]}
+            for r in rows
+        ]
+
+    def mark_sent(self, ids: List[int]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'sent', attempts = attempts + 1 WHERE id = ?",
+                [(i,) for i in ids]
+            )
+
+    def mark_retry(self, ids: List[int], error: str, delay: float):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'pending', attempts = attempts + 1, "
+                "next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(time.time() + delay, error, i) for i in ids]
+            )
+
+    def mark_failed(self, ids: List[int], error: str):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(error, i) for i in ids]
+            )
+
+    def count(self, status: str = 'pending') -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox WHERE status = ?', (status,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SMTPConnectionPool:
+    """SMTP连接池，连接在多次发送间复用，池大小即最大并发数"""
+
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 size: int = 4, use_tls: bool = True, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._slots: Optional[asyncio.Queue] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls()
+        if self.username and self.password:
+            conn.login(self.username, self.password)
+        return conn
+
+    def _send(self, slot: List, message: EmailMessage):
+        """在工作线程中发送，连接断开时重连一次"""
+        if slot[0] is None:
+            slot[0] = self._connect()
+        try:
+            slot[0].send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            slot[0] = self._connect()
+            slot[0].send_message(message)
+
+    async def send(self, message: EmailMessage):
+        if self._slots is None:
+            self._slots = asyncio.Queue()
+            for _ in range(self.size):
+                self._slots.put_nowait([None])
+        slot = await self._slots.get()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._send, slot, message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+            # 服务器拒绝了本条消息，连接本身仍可复用
+            raise
+        except Exception:
+            self._discard(slot)
+            raise
+        finally:
+            self._slots.put_nowait(slot)
+
+    @staticmethod
+    def _discard(slot: List):
+        if slot[0] is not None:
+            try:
+                slot[0].close()
+            except Exception:
+                pass
+            slot[0] = None
+
+    async def close(self):
+        if self._slots is None:
+            return
+        while not self._slots.empty():
+            slot = self._slots.get_nowait()
+            if slot[0] is not None:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, slot[0].quit)
+                except Exception:
+                    pass
+        self._slots = None
+
+
+class AlertDispatcher:
+    """异步批量发送价格提醒：同一收件人的多条提醒合并为一封邮件，失败按指数退避重试"""
+
+    def __init__(self, queue: NotificationQueue, pool: SMTPConnectionPool, sender: str,
+                 batch_size: int = 1000, max_attempts: int = 5,
+                 base_delay: float = 30, max_delay: float = 3600):
+        self.queue = queue
+        self.pool = pool
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._stopped = asyncio.Event()
+
+    def _build_message(self, email: str, items: List[Dict]) -> EmailMessage:
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = email
+        if len(items) == 1:
+            message['Subject'] = items[0]['subject']
+            message.set_content(items[0]['body'])
+        else:
+            message['Subject'] = f"价格提醒：您关注的 {len(items)} 件商品已降价"
+            message.set_content('\n\n'.join(f"{item['subject']}\n{item['body']}" for item in items))
+        return message
+
+    async def _db(self, func, *args):
+        """在线程池中执行队列的数据库操作"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _deliver(self, email: str, items: List[Dict]) -> Tuple[str, Optional[str]]:
+        """发送一封合并邮件，返回 (结果, 错误信息)"""
+        try:
+            await self.pool.send(self._build_message(email, items))
+        except smtplib.SMTPRecipientsRefused as e:
+            # 收件人被拒绝，重试无意义
+            return 'failed', str(e)
+        except smtplib.SMTPResponseException as e:
+            print(f"发送价格提醒失败: {email} {str(e)}")
+            # 5xx为永久性错误，4xx等临时错误才重试
+            if e.smtp_code >= 500:
+                return 'failed', str(e)
+            attempts = max(item['attempts'] for item in items) + 1
+            return ('failed' if attempts >= self.max_attempts else 'retry'), str(e)
+        except Exception as e:
+            print(f"发送价格提醒失败: {email} {str(e)}")
+            attempts = max(item['attempts'] for item in items) + 1
+            return ('failed' if attempts >= self.max_attempts else 'retry'), str(e)
+        return 'sent', None
+
+    async def dispatch_pending(self) -> Dict:
+        """发送所有到期的通知，调用stop后在当前批次结束时返回，返回发送统计"""
+        stats = {'alerts': 0, 'messages': 0, 'sent': 0, 'failed': 0, 'retried': 0}
+        start = time.perf_counter()
+        while not self._stopped.is_set():
+            batch = await self._db(self.queue.claim_batch, self.batch_size)
+            if not batch:
+                break
+            grouped: Dict[str, List[Dict]] = OrderedDict()
+            for item in batch:
+                grouped.setdefault(item['email'], []).append(item)
+
+            # 并发度由连接池大小限制
+            results = await asyncio.gather(*(
+                self._deliver(email, items) for email, items in grouped.items()
+            ))
+
+            # 按批次写回发送结果
+            sent_ids = []
+            for items, (result, error) in zip(grouped.values(), results):
+                ids = [item['id'] for item in items]
+                if result == 'sent':
+                    sent_ids.extend(ids)
+                    stats['sent'] += 1
+                    continue
+                if result == 'failed':
+                    stats['failed'] += 1
+                    await self._db(self.queue.mark_failed, ids, error)
+                else:
+                    stats['retried'] += 1
+                    attempts = max(item['attempts'] for item in items) + 1
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                    await self._db(self.queue.mark_retry, ids, error, delay)
+            await self._db(self.queue.mark_sent, sent_ids)
+            stats['alerts'] += len(batch)
+            stats['messages'] += len(grouped)
+
+        elapsed = time.perf_counter() - start
+        stats['elapsed'] = round(elapsed, 3)
+        stats['messages_per_second'] = round(stats['sent'] / elapsed, 1) if elapsed > 0 else 0.0
+        return stats
+
+    async def run(self, interval: float = 5):
+        """后台循环发送，直到调用stop"""
+        while not self._stopped.is_set():
+            try:
+                await self.dispatch_pending()
+            except Exception as e:
+                print(f"通知发送循环异常: {str(e)}")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+        await self.pool.close()
+
+    def stop(self):
+        self._stopped.set()
@@ -1,10 +1,14 @@
-from typing import Dict, List
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Tuple
 from .fair_api import FairAPI
+from .notification import NotificationQueue
 from .price_api import PriceAPI
+from .price_stats import PriceStatsStore
 from .taobao_api import TaobaoAPI
 
 class PriceService:
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, notification_queue: NotificationQueue = None):
         """
         初始化价格服务
         config: {
@@ -15,13 +19,19 @@ class PriceService:
                 'app_secret': 'your_app_secret'
             }
         }
+        notification_queue: 价格提醒队列，记录价格时触发达到目标价的提醒
         """
+        self.notification_queue = notification_queue
         self.fair_api = FairAPI(config.get('fair_api_key'))
         self.price_api = PriceAPI(config.get('price_api_key'))
         self.taobao_api = TaobaoAPI(
             config.get('taobao', {}).get('app_key'),
             config.get('taobao', {}).get('app_secret')
         )
+        self.price_stats = PriceStatsStore(
+            config.get('price_history_db', 'cache/price_history.db'),
+            config.get('price_stats_window_days', 30)
+        )
 
     async def search_product_all_platforms(self, keyword: str) -> Dict:
         """在所有平台搜索商品"""
@@ -31,10 +41,16 @@ class PriceService:
             'price_comparison': []  # 价格对比
         }
 
+        loop = asyncio.get_running_loop()
+
         # 获取淘宝数据
-        taobao_results = await self.taobao_api.search_products(keyword)
+        taobao_results = await loop.run_in_executor(None, self.taobao_api.search_products, keyword)
         if taobao_results:
             results['domestic'].extend(taobao_results)
+            # 搜索结果中的价格一次性批量记录，不阻塞事件循环
+            await loop.run_in_executor(None, self.record_prices, 'taobao', [
+                (item.get('num_iid'), item.get('zk_final_price'), None) for item in taobao_results
+            ])
 
         # 获取国际平台数据
         fair_results = self.fair_api.search_products(keyword)
@@ -50,12 +66,17 @@ class PriceService:
 
     async def get_product_details(self, product_id: str, platform: str) -> Dict:
         """获取商品详细信息"""
+        loop = asyncio.get_running_loop()
         if platform == 'taobao':
-            return await self.taobao_api.get_product_details(product_id)
+            details = await loop.run_in_executor(None, self.taobao_api.get_product_details, product_id)
+            price = details.get('zk_final_price')
         elif platform == 'amazon':
-            return self.fair_api.get_product_details(product_id)
+            details = self.fair_api.get_product_details(product_id, platform)
+            price = details.get('price')
         else:
             return {}
+        await loop.run_in_executor(None, self.record_price, product_id, platform, price)
+        return details
 
     def track_price(self, product_urls: List[str]) -> Dict:
         """设置价格追踪"""
@@ -67,18 +88,66 @@ class PriceService:
                 tracking_results[url] = result
         return tracking_results
 
+    def record_price(self, product_id: str, platform: str, price: float, timestamp: datetime = None):
+        """记录新的价格观测，增量更新统计"""
+        self.record_prices(platform, [(product_id, price, timestamp)])
+
+    def record_prices(self, platform: str, observations: List[Tuple]):
+        """
+        批量记录价格观测，无法解析的价格直接忽略
+        observations: [(product_id, price, timestamp), ...]
+        会访问SQLite，异步代码中需通过run_in_executor调用
+        """
+        valid = []
+        for product_id, price, timestamp in observations:
+            if not product_id:
+                continue
+            try:
+                valid.append((str(product_id), float(price), timestamp))
+            except (TypeError, ValueError):
+                continue
+        if not valid:
+            return
+        try:
+            accepted = self.price_stats.record_many(platform, valid)
+            # 只有最新的观测才触发价格提醒
+            if self.notification_queue:
+                for product_id, price in accepted:
+                    self.notification_queue.trigger_alerts(platform, product_id, price)
+        except Exception as e:
+            print(f"记录价格失败: {str(e)}")
+
+    def rebuild_price_stats(self, product_id: str, platform: str):
+        """
+        拉取远程历史价格保存到本地并重建统计
+        目前只有淘宝商品可拉取远程历史，其他平台依赖本地记录的观测
+        """
+        history = []
+        if platform == 'taobao':
+            product_url = f"https://item.taobao.com/item.htm?id={product_id}"
+            history = self.price_api.get_price_history(product_url)
+        self.price_stats.rebuild(product_id, platform, history)
+
+    def is_real_deal(self, product_id: str, platform: str, price: float) -> bool:
+        """判断当前价格是否为真实优惠"""
+        if not self.price_stats.is_fresh(product_id, platform):
+            self.rebuild_price_stats(product_id, platform)
+        return self.price_stats.is_real_deal(product_id, platform, price)
+
     def get_price_analysis(self, product_id: str, platform: str) -> Dict:
         """获取价格分析报告"""
         analysis = {
             'historical_prices': [],
+            'statistics': {},
             'market_insights': {},
             'price_comparison': []
         }
 
-        # 获取历史价格
-        if platform == 'taobao':
-            product_url = f"https://item.taobao.com/item.htm?id={product_id}"
-            analysis['historical_prices'] = self.price_api.get_price_history(product_url)
+        # 统计为空或过期时才拉取远程历史价格
+        if not self.price_stats.is_fresh(product_id, platform):
+            self.rebuild_price_stats(product_id, platform)
+        analysis['historical_prices'] = self.price_stats.history(product_id, platform)
+        analysis['statistics'] = self.price_stats.get(product_id, platform)
 
         # 获取市场洞察
         analysis['market_insights'] = self.price_api.get_market_insights(platform)
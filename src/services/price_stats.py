@@ -0,0 +1,344 @@
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+
+def to_utc(ts: Union[datetime, str, float, None] = None) -> datetime:
+    """统一转换为带时区的UTC时间，无时区信息的时间视为UTC"""
+    if ts is None:
+        return datetime.now(timezone.utc)
+    if isinstance(ts, (int, float)):
+        return datetime.fromtimestamp(ts, timezone.utc)
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+class P2Quantile:
+    """P²算法流式分位数估计，固定5个标记点，O(1)内存和更新"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self._initial: List[float] = []
+        self._q: List[float] = []
+        self._n: List[int] = []
+        self._np: List[float] = []
+        self._dn = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x: float):
+        if len(self._initial) < 5:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._initial.sort()
+                self._q = list(self._initial)
+                self._n = [0, 1, 2, 3, 4]
+                self._np = [0, 2 * self.p, 4 * self.p, 2 + 2 * self.p, 4]
+            return
+
+        q, n = self._q, self._n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._np[i] += self._dn[i]
+
+        # 调整中间三个标记点
+        for i in range(1, 4):
+            d = self._np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = self._parabolic(i, d)
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self._q, self._n
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        if self._q:
+            return self._q[2]
+        if not self._initial:
+            return None
+        # 样本不足5个时直接取最近秩
+        values = sorted(self._initial)
+        return values[min(len(values) - 1, int(round(self.p * (len(values) - 1))))]
+
+
+class ProductPriceStats:
+    """
+    单个商品的增量价格统计：滚动窗口最小/最大/均值、流式分位数及最近变价时间
+    P²分位数无法删除过期样本，每隔一个窗口用窗口内的观测重建，因此覆盖最近一到两个窗口
+    """
+
+    def __init__(self, window_days: int = 30, quantiles: Tuple[float, ...] = (0.25, 0.5, 0.75)):
+        self.window = timedelta(days=window_days)
+        self._window: deque = deque()  # (timestamp, price)
+        self._min: deque = deque()  # 单调递增，队首为窗口最小值
+        self._max: deque = deque()  # 单调递减，队首为窗口最大值
+        self._sum = 0.0
+        self._quantiles = {p: P2Quantile(p) for p in quantiles}
+        self._sketch_start: Optional[datetime] = None
+        self.count = 0
+        self.last_price: Optional[float] = None
+        self.last_seen: Optional[datetime] = None
+        self.last_change: Optional[datetime] = None
+        # 最近一次观测之前的窗口最低价，用于判断当前价格是否低于此前的价格
+        self.prior_min: Optional[float] = None
+        self.refreshed_at: Optional[datetime] = None
+
+    @property
+    def quantiles(self) -> Tuple[float, ...]:
+        return tuple(self._quantiles)
+
+    def add(self, price: float, timestamp: datetime = None) -> bool:
+        """
+        记录一次价格观测，观测需按时间顺序到达
+        早于上一次观测的价格不计入统计并返回False，按时间排序重建后才会被计入
+        """
+        timestamp = to_utc(timestamp)
+        if self.last_seen and timestamp < self.last_seen:
+            return False
+
+        self._evict(timestamp)
+        self._roll_sketches(timestamp)
+        self.prior_min = self._min[0][1] if self._min else None
+
+        self._window.append((timestamp, price))
+        self._sum += price
+        while self._min and self._min[-1][1] > price:
+            self._min.pop()
+        self._min.append((timestamp, price))
+        while self._max and self._max[-1][1] < price:
+            self._max.pop()
+        self._max.append((timestamp, price))
+        for sketch in self._quantiles.values():
+            sketch.add(price)
+
+        if self.last_price is None or price != self.last_price:
+            self.last_change = timestamp
+        self.last_price = price
+        self.last_seen = timestamp
+        self.count += 1
+        return True
+
+    def _evict(self, now: datetime):
+        cutoff = now - self.window
+        while self._window and self._window[0][0] < cutoff:
+            _, price = self._window.popleft()
+            self._sum -= price
+        while self._min and self._min[0][0] < cutoff:
+            self._min.popleft()
+        while self._max and self._max[0][0] < cutoff:
+            self._max.popleft()
+
+    def _roll_sketches(self, now: datetime):
+        """分位数样本跨越超过一个窗口时，用当前窗口内的观测重建"""
+        if self._sketch_start is not None and now - self._sketch_start <= self.window:
+            return
+        self._quantiles = {p: P2Quantile(p) for p in self._quantiles}
+        for _, price in self._window:
+            for sketch in self._quantiles.values():
+                sketch.add(price)
+        self._sketch_start = self._window[0][0] if self._window else now
+
+    def snapshot(self, now: datetime = None) -> Dict:
+        """返回当前统计结果"""
+        now = to_utc(now)
+        self._evict(now)
+        self._roll_sketches(now)
+        size = len(self._window)
+        return {
+            'count': self.count,
+            'window_days': self.window.days,
+            'window_count': size,
+            'window_min': self._min[0][1] if self._min else None,
+            'window_max': self._max[0][1] if self._max else None,
+            'window_mean': round(self._sum / size, 2) if size else None,
+            'quantiles': {str(p): sketch.value() for p, sketch in self._quantiles.items()},
+            'last_price': self.last_price,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'last_change': self.last_change.isoformat() if self.last_change else None,
+        }
+
+
+class PriceStatsStore:
+    """
+    按商品维护增量价格统计，每次新价格观测时更新，读取为O(1)
+    原始观测保存在本地SQLite中，进程重启或统计被淘汰后按需从中重建
+    """
+
+    def __init__(self, db_path: str = 'cache/price_history.db', window_days: int = 30,
+                 stale_after: timedelta = timedelta(days=1), max_products: int = 10000):
+        self.window_days = window_days
+        self.stale_after = stale_after
+        self.max_products = max_products
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 可能在线程池中调用，连接跨线程共享，由锁串行化
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS price_history (
+                product_key TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                price REAL NOT NULL,
+                PRIMARY KEY (product_key, observed_at)
+            )
+            """
+        )
+        self._conn.commit()
+        self._stats: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def _key(product_id: str, platform: str) -> str:
+        return f"{platform}:{product_id}"
+
+    def _load(self, key: str) -> ProductPriceStats:
+        """获取内存中的统计，不存在时从本地历史重建，超过max_products时淘汰最久未用的商品"""
+        stats = self._stats.get(key)
+        if stats is not None:
+            self._stats.move_to_end(key)
+            return stats
+        stats = ProductPriceStats(self.window_days)
+        rows = self._conn.execute(
+            'SELECT observed_at, price FROM price_history WHERE product_key = ? ORDER BY observed_at',
+            (key,)
+        )
+        for observed_at, price in rows:
+            stats.add(price, to_utc(observed_at))
+        self._stats[key] = stats
+        while len(self._stats) > self.max_products:
+            self._stats.popitem(last=False)
+        return stats
+
+    def _insert(self, key: str, timestamp: datetime, price: float) -> bool:
+        """保存一条观测，相同时间的重复观测返回False"""
+        cursor = self._conn.execute(
+            'INSERT OR IGNORE INTO price_history (product_key, observed_at, price) VALUES (?, ?, ?)',
+            (key, timestamp.timestamp(), price)
+        )
+        return cursor.rowcount == 1
+
+    def record(self, product_id: str, platform: str, price: float, timestamp: datetime = None) -> bool:
+        """记录一次价格观测，返回是否代表当前价格"""
+        return bool(self.record_many(platform, [(product_id, price, timestamp)]))
+
+    def record_many(self, platform: str, observations: List[Tuple]) -> List[Tuple[str, float]]:
+        """
+        在一个事务中批量记录价格观测
+        observations: [(product_id, price, timestamp), ...]，timestamp为None时取当前时间
+        返回代表当前价格的观测 [(product_id, price), ...]：是该商品最新的观测，且未超过stale_after
+        重复的观测被忽略；乱序的观测只保存，下次重建时按时间顺序计入
+        """
+        accepted = []
+        now = to_utc()
+        with self._lock, self._conn:
+            for product_id, price, timestamp in observations:
+                key = self._key(product_id, platform)
+                stats = self._load(key)
+                timestamp = to_utc(timestamp)
+                if not self._insert(key, timestamp, float(price)):
+                    continue
+                if stats.add(float(price), timestamp):
+                    if now - timestamp <= self.stale_after:
+                        accepted.append((product_id, float(price)))
+                else:
+                    self._stats.pop(key)
+        return accepted
+
+    def rebuild(self, product_id: str, platform: str, history: List[Dict] = None):
+        """
+        保存历史价格，有新数据时从本地历史重建统计
+        history: [{'price': 99.0, 'date': '2024-01-01T00:00:00Z'}, ...]
+        """
+        key = self._key(product_id, platform)
+        with self._lock:
+            inserted = False
+            with self._conn:
+                for item in history or []:
+                    try:
+                        price = float(item['price'])
+                        ts = to_utc(item.get('date') or item.get('timestamp'))
+                    except Exception as e:
+                        print(f"解析历史价格失败: {str(e)}")
+                        continue
+                    inserted = self._insert(key, ts, price) or inserted
+            if inserted:
+                self._stats.pop(key, None)
+            # 即使没有新数据也记录刷新时间，stale_after内不再重复重建
+            self._load(key).refreshed_at = to_utc()
+
+    def is_fresh(self, product_id: str, platform: str) -> bool:
+        """stale_after内刷新过，或窗口内有未过期的观测"""
+        with self._lock:
+            stats = self._load(self._key(product_id, platform))
+            now = to_utc()
+            if stats.refreshed_at and now - stats.refreshed_at <= self.stale_after:
+                return True
+            if stats.last_seen is None or now - stats.last_seen > self.stale_after:
+                return False
+            return stats.snapshot(now)['window_count'] > 0
+
+    def get(self, product_id: str, platform: str) -> Dict:
+        """获取商品统计"""
+        with self._lock:
+            return self._load(self._key(product_id, platform)).snapshot()
+
+    def history(self, product_id: str, platform: str, days: int = 30) -> List[Dict]:
+        """读取本地保存的历史价格"""
+        since = (to_utc() - timedelta(days=days)).timestamp()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT observed_at, price FROM price_history WHERE product_key = ? AND observed_at >= ? '
+                'ORDER BY observed_at',
+                (self._key(product_id, platform), since)
+            ).fetchall()
+        return [{'price': price, 'date': to_utc(observed_at).isoformat()} for observed_at, price in rows]
+
+    def is_real_deal(self, product_id: str, platform: str, price: float, quantile: float = 0.25) -> bool:
+        """
+        判断价格是否为真实优惠：窗口内价格有波动，且价格低于此前的窗口最低价或低于窗口quantile分位数
+        price等于最近一次观测时与该观测之前的最低价比较，长期不变的价格不算优惠
+        quantile必须是已统计的分位数之一，窗口内无观测时返回False
+        """
+        with self._lock:
+            stats = self._load(self._key(product_id, platform))
+            if quantile not in stats.quantiles:
+                raise ValueError(f"未统计的分位数: {quantile}，可选: {stats.quantiles}")
+            snapshot = stats.snapshot()
+            reference = stats.prior_min if price == stats.last_price else snapshot['window_min']
+        if snapshot['window_count'] == 0:
+            return False
+        if max(snapshot['window_max'], price) <= min(snapshot['window_min'], price):
+            return False
+        if reference is not None and price < reference:
+            return True
+        threshold = snapshot['quantiles'][str(quantile)]
+        return threshold is not None and price < threshold
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,46 @@
+"""
+价格提醒发送基准测试，使用本地SMTP测试桩
+python -m tests.bench_notification --alerts 20000 --recipients 5000 --pool-size 8
+"""
+import argparse
+import asyncio
+import tempfile
+from pathlib import Path
+
+from src.services.notification import AlertDispatcher, NotificationQueue, SMTPConnectionPool
+from tests.smtp_stub import SMTPStub
+
+
+async def bench(alerts: int, recipients: int, pool_size: int, batch_size: int):
+    stub = SMTPStub()
+    port = await stub.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = NotificationQueue(str(Path(tmp) / 'notifications.db'))
+        queue.enqueue_many([
+            {'email': f'user{i % recipients}@example.com', 'subject': f'提醒 {i}', 'body': '商品已降价'}
+            for i in range(alerts)
+        ])
+        pool = SMTPConnectionPool('127.0.0.1', port, size=pool_size, use_tls=False)
+        dispatcher = AlertDispatcher(queue, pool, 'alerts@example.com', batch_size=batch_size)
+        stats = await dispatcher.dispatch_pending()
+        await pool.close()
+        queue.close()
+    await stub.close()
+    stats['connections'] = stub.connections
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='价格提醒发送基准测试')
+    parser.add_argument('--alerts', type=int, default=20000)
+    parser.add_argument('--recipients', type=int, default=5000)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    stats = asyncio.run(bench(args.alerts, args.recipients, args.pool_size, args.batch_size))
+    print(stats)
+    print(f"messages_per_second: {stats['messages_per_second']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Dict, List
+
+
+class SMTPStub:
+    """
+    本地SMTP测试桩，不支持STARTTLS，需配合use_tls=False使用
+    收件人地址前缀控制响应：refused@ 在RCPT时返回550，reject@ 在DATA后返回554，later@ 在DATA后返回451
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.messages: List[Dict] = []
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        writer.write(b'220 stub ESMTP\r\n')
+        mail_from, rcpts, data = None, [], None
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if data is not None:
+                if line != b'.\r\n':
+                    data.append(line)
+                    continue
+                if any(r.startswith('reject@') for r in rcpts):
+                    writer.write(b'554 message rejected\r\n')
+                elif any(r.startswith('later@') for r in rcpts):
+                    writer.write(b'451 try again later\r\n')
+                else:
+                    self.messages.append({
+                        'from': mail_from,
+                        'to': rcpts,
+                        'data': b''.join(data).decode('utf-8', 'replace')
+                    })
+                    writer.write(b'250 queued\r\n')
+                mail_from, rcpts, data = None, [], None
+            else:
+                command = line.decode().strip()
+                verb = command[:4].upper()
+                argument = command.split(':', 1)[1].strip().strip('<>') if ':' in command else ''
+                if verb == 'MAIL':
+                    mail_from = argument
+                    writer.write(b'250 ok\r\n')
+                elif verb == 'RCPT':
+                    if argument.startswith('refused@'):
+                        writer.write(b'550 no such user\r\n')
+                    else:
+                        rcpts.append(argument)
+                        writer.write(b'250 ok\r\n')
+                elif verb == 'DATA':
+                    data = []
+                    writer.write(b'354 end with .\r\n')
+                elif verb == 'QUIT':
+                    writer.write(b'221 bye\r\n')
+                    await writer.drain()
+                    break
+                elif verb == 'RSET':
+                    mail_from, rcpts = None, []
+                    writer.write(b'250 ok\r\n')
+                else:
+                    writer.write(b'250 ok\r\n')
+            await writer.drain()
+        writer.close()
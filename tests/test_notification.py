@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import pytest
+
+from src.services.notification import AlertDispatcher, NotificationQueue, SMTPConnectionPool
+from tests.smtp_stub import SMTPStub
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = NotificationQueue(str(tmp_path / 'notifications.db'))
+    yield queue
+    queue.close()
+
+
+def outbox(queue):
+    return queue._conn.execute(
+        'SELECT email, status, attempts, next_attempt_at, last_error FROM outbox ORDER BY id'
+    ).fetchall()
+
+
+async def dispatch(queue, pool_size=2, **kwargs):
+    stub = SMTPStub()
+    port = await stub.start()
+    pool = SMTPConnectionPool('127.0.0.1', port, size=pool_size, use_tls=False)
+    dispatcher = AlertDispatcher(queue, pool, 'alerts@example.com', **kwargs)
+    stats = await dispatcher.dispatch_pending()
+    await pool.close()
+    await stub.close()
+    return stats, stub
+
+
+def test_coalesces_alerts_per_recipient(queue):
+    queue.enqueue_many([
+        {'email': f'user{i % 3}@example.com', 'subject': f'提醒 {i}', 'body': f'内容 {i}'}
+        for i in range(30)
+    ])
+    stats, stub = asyncio.run(dispatch(queue, batch_size=2))
+    assert stats['alerts'] == 30
+    assert stats['messages'] == stats['sent'] == 3
+    assert sorted(m['to'][0] for m in stub.messages) == [f'user{i}@example.com' for i in range(3)]
+    assert all(m['from'] == 'alerts@example.com' for m in stub.messages)
+    assert queue.count('sent') == 30
+    assert queue.count('pending') == 0
+
+
+def test_reuses_connections(queue):
+    queue.enqueue_many([
+        {'email': f'user{i}@example.com', 'subject': 's', 'body': 'b'} for i in range(200)
+    ])
+    stats, stub = asyncio.run(dispatch(queue, pool_size=3, batch_size=50))
+    assert stats['sent'] == 200
+    assert len(stub.messages) == 200
+    assert stub.connections == 3
+
+
+def test_recipient_refused_fails_immediately(queue):
+    queue.enqueue('refused@example.com', 's', 'b')
+    queue.enqueue('ok@example.com', 's', 'b')
+    stats, _ = asyncio.run(dispatch(queue))
+    assert stats['sent'] == 1
+    assert stats['failed'] == 1
+    assert stats['retried'] == 0
+    assert [(r[0], r[1], r[2]) for r in outbox(queue)] == [
+        ('refused@example.com', 'failed', 1),
+        ('ok@example.com', 'sent', 1),
+    ]
+
+
+def test_permanent_5xx_fails_immediately(queue):
+    queue.enqueue('reject@example.com', 's', 'b')
+    stats, _ = asyncio.run(dispatch(queue))
+    assert stats['failed'] == 1
+    assert stats['retried'] == 0
+    email, status, attempts, _, error = outbox(queue)[0]
+    assert (status, attempts) == ('failed', 1)
+    assert '554' in error
+
+
+def test_transient_error_retries_with_backoff(queue):
+    queue.enqueue('later@example.com', 's', 'b')
+
+    for attempt, delay in [(1, 60), (2, 120)]:
+        before = time.time()
+        stats, _ = asyncio.run(dispatch(queue, base_delay=60, max_attempts=3))
+        assert stats['retried'] == 1
+        assert stats['failed'] == 0
+        _, status, attempts, next_attempt_at, error = outbox(queue)[0]
+        assert (status, attempts) == ('pending', attempt)
+        assert before + delay <= next_attempt_at <= time.time() + delay
+        assert '451' in error
+
+        # 未到重试时间不会被取出
+        assert queue.claim_batch(10) == []
+        queue._conn.execute('UPDATE outbox SET next_attempt_at = 0')
+
+    stats, _ = asyncio.run(dispatch(queue, base_delay=60, max_attempts=3))
+    assert stats['failed'] == 1
+    assert outbox(queue)[0][1:3] == ('failed', 3)
+
+
+def test_interrupted_sending_is_requeued(tmp_path):
+    path = str(tmp_path / 'notifications.db')
+    queue = NotificationQueue(path)
+    queue.enqueue('user@example.com', 's', 'b')
+    assert len(queue.claim_batch(10)) == 1
+    queue.close()
+
+    queue = NotificationQueue(path)
+    assert queue.count('pending') == 1
+    queue.close()
+
+
+def test_trigger_alerts(queue):
+    queue.add_alert('taobao', 1, 100, 'a@example.com')
+    queue.add_alert('taobao', 1, 80, 'b@example.com')
+    queue.add_alert('taobao', 2, 100, 'c@example.com')
+    queue.add_alert('amazon', 1, 100, 'd@example.com')
+    assert queue.trigger_alerts('taobao', 1, 120) == 0
+    assert queue.trigger_alerts('taobao', 1, 90) == 1
+    assert queue.count('pending') == 1
+    # 已触发的订阅不会重复通知
+    assert queue.trigger_alerts('taobao', 1, 90) == 0
+    assert queue.trigger_alerts('taobao', 1, 70) == 1
+    assert [r[0] for r in outbox(queue)] == ['a@example.com', 'b@example.com']
+
+
+class SlowPool:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, message):
+        await asyncio.sleep(0.001)
+        self.sent += 1
+
+    async def close(self):
+        pass
+
+
+def test_stop_leaves_remaining_alerts_pending(queue):
+    queue.enqueue_many([
+        {'email': f'user{i}@example.com', 'subject': 's', 'body': 'b'} for i in range(3000)
+    ])
+    pool = SlowPool()
+
+    async def run():
+        dispatcher = AlertDispatcher(queue, pool, 'alerts@example.com', batch_size=50)
+        task = asyncio.create_task(dispatcher.run())
+        await asyncio.sleep(0.05)
+        dispatcher.stop()
+        await asyncio.wait_for(task, timeout=5)
+
+    asyncio.run(run())
+    assert 0 < pool.sent < 3000
+    assert queue.count('pending') == 3000 - pool.sent
@@ -0,0 +1,234 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.services.price_stats import P2Quantile, PriceStatsStore, ProductPriceStats, to_utc
+
+NOW = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PriceStatsStore(str(tmp_path / 'price_history.db'))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('p', [0.25, 0.5, 0.75, 0.9])
+def test_p2_quantile_close_to_exact(p):
+    rng = random.Random(42)
+    values = [rng.uniform(0, 1000) for _ in range(20000)]
+    sketch = P2Quantile(p)
+    for v in values:
+        sketch.add(v)
+    exact = sorted(values)[int(p * (len(values) - 1))]
+    assert sketch.value() == pytest.approx(exact, abs=20)
+
+
+def test_p2_quantile_small_sample():
+    sketch = P2Quantile(0.5)
+    assert sketch.value() is None
+    for v in [5, 1, 3]:
+        sketch.add(v)
+    assert sketch.value() == 3
+
+
+def test_window_min_max_mean_match_brute_force():
+    rng = random.Random(1)
+    stats = ProductPriceStats(window_days=3)
+    observations = []
+    for i in range(500):
+        ts = NOW + timedelta(hours=6 * i)
+        price = rng.uniform(10, 100)
+        stats.add(price, ts)
+        observations.append((ts, price))
+        in_window = [p for t, p in observations if t >= ts - timedelta(days=3)]
+        snapshot = stats.snapshot(ts)
+        assert snapshot['window_min'] == min(in_window)
+        assert snapshot['window_max'] == max(in_window)
+        assert snapshot['window_mean'] == round(sum(in_window) / len(in_window), 2)
+
+
+def test_window_eviction_across_boundary():
+    stats = ProductPriceStats(window_days=30)
+    stats.add(50, NOW - timedelta(days=31))
+    stats.add(80, NOW - timedelta(days=29))
+    snapshot = stats.snapshot(NOW)
+    assert snapshot['window_count'] == 1
+    assert snapshot['window_min'] == 80
+    assert snapshot['count'] == 2
+
+    snapshot = stats.snapshot(NOW + timedelta(days=2))
+    assert snapshot['window_count'] == 0
+    assert snapshot['window_min'] is None
+
+
+def test_last_change_only_moves_on_price_change():
+    stats = ProductPriceStats()
+    stats.add(10, NOW)
+    stats.add(10, NOW + timedelta(hours=1))
+    stats.add(8, NOW + timedelta(hours=2))
+    stats.add(8, NOW + timedelta(hours=3))
+    assert stats.last_change == NOW + timedelta(hours=2)
+    assert stats.last_seen == NOW + timedelta(hours=3)
+
+
+def test_out_of_order_observation_rejected():
+    stats = ProductPriceStats()
+    assert stats.add(10, NOW)
+    assert not stats.add(1, NOW - timedelta(hours=1))
+    assert stats.count == 1
+    assert stats.snapshot(NOW)['window_min'] == 10
+
+
+def test_to_utc_normalizes_naive_and_aware():
+    assert to_utc('2026-10-18T00:00:00Z') == NOW
+    assert to_utc('2026-10-18T08:00:00+08:00') == NOW
+    assert to_utc(datetime(2026, 10, 18)) == NOW
+    assert to_utc(NOW.timestamp()) == NOW
+
+
+def test_rebuild_from_timezone_aware_history(store):
+    now = datetime.now(timezone.utc)
+    history = [
+        {'price': 120, 'date': (now - timedelta(days=2)).isoformat().replace('+00:00', 'Z')},
+        {'price': 100, 'date': (now - timedelta(days=1)).astimezone(timezone(timedelta(hours=8))).isoformat()},
+        {'price': 'bad', 'date': now.isoformat()},
+    ]
+    store.rebuild('1', 'taobao', history)
+    stats = store.get('1', 'taobao')
+    assert stats['window_count'] == 2
+    assert stats['window_min'] == 100
+    assert stats['last_price'] == 100
+    assert [h['price'] for h in store.history('1', 'taobao')] == [120, 100]
+
+
+def test_stats_survive_restart(tmp_path):
+    path = str(tmp_path / 'price_history.db')
+    now = datetime.now(timezone.utc)
+    store = PriceStatsStore(path)
+    store.record('1', 'amazon', 30, now - timedelta(hours=2))
+    store.record('1', 'amazon', 20, now - timedelta(hours=1))
+    store.close()
+
+    store = PriceStatsStore(path)
+    stats = store.get('1', 'amazon')
+    assert stats['window_count'] == 2
+    assert stats['window_min'] == 20
+    store.close()
+
+
+def test_record_out_of_order_is_kept_after_rebuild(store):
+    now = datetime.now(timezone.utc)
+    store.record('1', 'amazon', 30, now - timedelta(hours=1))
+    store.record('1', 'amazon', 10, now - timedelta(hours=2))
+    stats = store.get('1', 'amazon')
+    assert stats['window_count'] == 2
+    assert stats['window_min'] == 10
+    assert stats['last_price'] == 30
+
+
+def test_is_fresh(store):
+    now = datetime.now(timezone.utc)
+    assert not store.is_fresh('1', 'amazon')
+    store.record('1', 'amazon', 30, now - timedelta(days=2))
+    assert not store.is_fresh('1', 'amazon')
+    store.record('1', 'amazon', 30, now)
+    assert store.is_fresh('1', 'amazon')
+
+
+def test_is_real_deal(store):
+    now = datetime.now(timezone.utc)
+    assert not store.is_real_deal('1', 'amazon', 1)
+    for i, price in enumerate([100, 90, 110, 95, 105, 120, 115, 100]):
+        store.record('1', 'amazon', price, now - timedelta(hours=10 - i))
+    assert store.is_real_deal('1', 'amazon', 85)
+    assert not store.is_real_deal('1', 'amazon', 110)
+    assert not store.is_real_deal('1', 'amazon', 120)
+    with pytest.raises(ValueError):
+        store.is_real_deal('1', 'amazon', 85, quantile=0.1)
+
+
+def test_flat_price_is_not_a_deal(store):
+    now = datetime.now(timezone.utc)
+    for i in range(10):
+        store.record('1', 'amazon', 100, now - timedelta(hours=10 - i))
+    assert not store.is_real_deal('1', 'amazon', 100)
+    assert store.is_real_deal('1', 'amazon', 90)
+
+
+def test_recorded_drop_is_a_deal(store):
+    now = datetime.now(timezone.utc)
+    for i in range(5):
+        store.record('1', 'amazon', 100, now - timedelta(hours=10 - i))
+    store.record('1', 'amazon', 80, now)
+    assert store.is_real_deal('1', 'amazon', 80)
+    assert not store.is_real_deal('1', 'amazon', 100)
+
+
+def test_quantiles_follow_the_window():
+    stats = ProductPriceStats(window_days=30)
+    for i in range(100):
+        stats.add(1000, NOW - timedelta(days=100) + timedelta(hours=i))
+    for i in range(100):
+        stats.add(10 + i % 5, NOW - timedelta(days=5) + timedelta(hours=i))
+    quantiles = stats.snapshot(NOW)['quantiles']
+    assert all(10 <= value <= 14 for value in quantiles.values())
+
+
+def test_duplicate_observation_ignored(tmp_path):
+    path = str(tmp_path / 'price_history.db')
+    now = datetime.now(timezone.utc)
+    store = PriceStatsStore(path)
+    assert store.record('1', 'amazon', 30, now)
+    assert not store.record('1', 'amazon', 20, now)
+    before = store.get('1', 'amazon')
+    assert before['count'] == 1
+    store.close()
+
+    store = PriceStatsStore(path)
+    assert store.get('1', 'amazon') == before
+    store.close()
+
+
+def test_record_many_returns_newest_observations(store):
+    now = datetime.now(timezone.utc)
+    accepted = store.record_many('taobao', [
+        ('1', 10, now),
+        ('2', 20, now),
+        ('1', 5, now - timedelta(days=400)),
+        ('3', 30, now - timedelta(days=400)),
+    ])
+    assert accepted == [('1', 10.0), ('2', 20.0)]
+    assert store.get('3', 'taobao')['last_price'] == 30
+    assert store.get('1', 'taobao')['count'] == 2
+    assert store.get('1', 'taobao')['last_price'] == 10
+
+
+def test_rebuild_without_new_data_keeps_cache(store):
+    store.rebuild('1', 'taobao', [])
+    assert store.is_fresh('1', 'taobao')
+
+    now = datetime.now(timezone.utc)
+    store.record('2', 'taobao', 10, now - timedelta(days=3))
+    cached = store._stats['taobao:2']
+    assert not store.is_fresh('2', 'taobao')
+    store.rebuild('2', 'taobao', [])
+    assert store._stats['taobao:2'] is cached
+    assert store.is_fresh('2', 'taobao')
+
+    store.rebuild('2', 'taobao', [{'price': 8, 'date': now.isoformat()}])
+    assert store._stats['taobao:2'] is not cached
+    assert store.get('2', 'taobao')['last_price'] == 8
+
+
+def test_lru_cap(tmp_path):
+    store = PriceStatsStore(str(tmp_path / 'price_history.db'), max_products=2)
+    now = datetime.now(timezone.utc)
+    for product_id in ['1', '2', '3']:
+        store.record(product_id, 'amazon', 10, now)
+    assert list(store._stats) == ['amazon:2', 'amazon:3']
+    assert store.get('1', 'amazon')['last_price'] == 10
+    assert list(store._stats) == ['amazon:3', 'amazon:1']
+    store.close()